@@ -15,11 +15,21 @@
 
 """Genetic algorithm for feature selection"""
 
+import copy
 import numbers
-import multiprocess
-import itertools
+import os
+import shutil
+import tempfile
+from collections import OrderedDict, deque
+from contextlib import ExitStack
+from functools import partial
+from operator import attrgetter
 import numpy as np
+from joblib import Parallel, delayed, dump, load, parallel_backend
+from joblib import hash as hash_data
+from scipy import sparse
 from sklearn.utils import check_X_y
+from sklearn.utils.validation import check_memory
 from sklearn.utils.metaestimators import if_delegate_has_method
 from sklearn.base import BaseEstimator
 from sklearn.base import MetaEstimatorMixin
@@ -35,24 +45,140 @@ from deap import algorithms
 from deap import base
 from deap import creator
 from deap import tools
+from deap.benchmarks.tools import hypervolume
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional, the helpers below also run as plain NumPy code
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+class _Individual(np.ndarray):
+    """Genome stored as a contiguous ``int8`` array, one byte per gene.
+
+    Crossover and mutation operate on the whole array at once and the array
+    can be viewed as a boolean mask without any copy.
+    """
+    def __new__(cls, genes):
+        return np.array(genes, dtype=np.int8).view(cls)
+
+    @property
+    def mask(self):
+        return self.view(dtype=bool, type=np.ndarray)
+
+    def __deepcopy__(self, memo):
+        copy_ = np.ndarray.copy(self)
+        copy_.__dict__.update(copy.deepcopy(self.__dict__, memo))
+        return copy_
+
+    def __reduce__(self):
+        return (self.__class__, (self.view(np.ndarray),), self.__dict__)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+class _FitnessStatistics(object):
+    """Statistics of the fitness values of a population.
+
+    Replaces a ``tools.Statistics`` with avg/std/min/max registered, stacking the
+    fitness values in a single pass over the population.
+    """
+    fields = ['avg', 'std', 'min', 'max']
+
+    def compile(self, population):
+        values = np.array([ind.fitness.values for ind in population])
+        return {'avg': values.mean(axis=0), 'std': values.std(axis=0),
+                'min': values.min(axis=0), 'max': values.max(axis=0)}
+
+
+class _HallOfFame(tools.HallOfFame):
+    """Hall of fame keeping the single best individual ever seen.
+
+    The held individual is replaced by the best individual of a population
+    that strictly improves on its fitness and has different genes, as in
+    ``tools.HallOfFame.update``. The genes are only compared for the
+    individuals that improve on the fitness.
+    """
+    def __init__(self):
+        super(_HallOfFame, self).__init__(1)
+
+    def update(self, population):
+        if len(self) == 0:
+            self.insert(max(population, key=attrgetter("fitness")))
+            return
+        held = self[0]
+        best = held
+        for ind in population:
+            if ind.fitness > best.fitness and not np.array_equal(ind, held):
+                best = ind
+        if best is not held:
+            self.remove(0)
+            self.insert(best)
 
 
 #@ specify 3 objectives: (1) mean CV ACC (maximize), (2) num. of features (minimize), (3) std of CV ACC's (minimize)
 #@ the magnitude of the weight is used to vary the importance of each objective one against another (here all 1's mean that all 3 objs are equally important)
 creator.create("Fitness_new", base.Fitness, weights=(1.0, -0.1, -0.5))
-creator.create("Individual_new", list, fitness=creator.Fitness_new)
+creator.create("Individual_new", _Individual, fitness=creator.Fitness_new)
+
+# Minimum gain per generation over the last n_gen_no_change generations, relative for the hypervolume
+# and absolute for each objective mean of the Pareto front, for the optimization to continue
+_HV_TOL = 1e-4
+_OBJ_TOL = 5e-4
 
 
-def _eaFunction(population, toolbox, cxpb, mutpb, ngen, ngen_no_change=None, stats=None,
-                halloffame=None, verbose=0, hparams=None, hparam_bits=0):
+def _referencePoint(population, max_features):
+    # Reference point of the hypervolume, just beyond the worst feasible individual of the population on
+    # each objective, and beyond max_features on the number of features, so that the later fronts stay
+    # inside the box when trading accuracy for more features or a larger std
+    wvalues = np.array([ind.fitness.wvalues for ind in population if ind.fitness.values[0] != -10000])
+    worst = -wvalues.min(axis=0)  # hypervolume minimizes -wvalues
+    ref = worst + 0.1 * np.maximum(np.abs(worst), 1.0)
+    ref[1] = -creator.Fitness_new.weights[1] * (max_features + 1)
+    return ref
+
+
+def _frontStatistics(population, ref):
+    # Hypervolume and per-objective mean of the Pareto front of the feasible individuals of the population
+    feasible_ind = [ind for ind in population if ind.fitness.values[0] != -10000]
+    front = tools.sortNondominated(feasible_ind, len(feasible_ind), first_front_only=True)[0]
+    return hypervolume(front, ref), np.mean([ind.fitness.values for ind in front], axis=0)
+
+
+def _evalInvalid(population, toolbox, max_features, hparam_bits):
+    # Evaluate the individuals with an invalid fitness. The infeasible ones (no feature or more than
+    # max_features) are scored here in a single pass, and the others are dispatched once per unique genome
+    invalid_ind = [ind for ind in population if not ind.fitness.valid]
+    if not invalid_ind:
+        return invalid_ind
+    individual_sums = np.asarray(invalid_ind)[:, hparam_bits:].sum(axis=1)
+    feasible_ind = []
+    for ind, individual_sum in zip(invalid_ind, individual_sums.tolist()):
+        if individual_sum == 0 or individual_sum > max_features:
+            ind.fitness.values = -10000, individual_sum, 10000
+        else:
+            feasible_ind.append(ind)
+    keys = [np.packbits(ind.mask).tobytes() for ind in feasible_ind]
+    unique_ind = {}
+    for key, ind in zip(keys, feasible_ind):
+        unique_ind.setdefault(key, ind)
+    unique_fits = dict(zip(unique_ind, toolbox.map(toolbox.evaluate, list(unique_ind.values()))))  #@ apply _evalFunction() on each unique ind
+    for key, ind in zip(keys, feasible_ind):
+        ind.fitness.values = unique_fits[key]
+    return invalid_ind
+
+
+def _eaFunction(population, toolbox, cxpb, mutpb, ngen, max_features, ngen_no_change=None, stats=None,
+                halloffame=None, verbose=0, hparam_bits=0):
     logbook = tools.Logbook()
     logbook.header = ['gen', 'nevals'] + (stats.fields if stats else [])
 
     # Evaluate the individuals with an invalid fitness
-    invalid_ind = [ind for ind in population if not ind.fitness.valid]
-    fitnesses = toolbox.map(toolbox.evaluate, invalid_ind)  #@ apply _evalFunction() on each of the ind in invalid_ind
-    for ind, fit in zip(invalid_ind, fitnesses):
-        ind.fitness.values = fit
+    invalid_ind = _evalInvalid(population, toolbox, max_features, hparam_bits)
 
     if halloffame is None:
         raise ValueError("The 'halloffame' parameter should not be None.")
@@ -65,39 +191,40 @@ def _eaFunction(population, toolbox, cxpb, mutpb, ngen, ngen_no_change=None, sta
     if verbose:
         print(logbook.stream)
 
+    # Keep the best hypervolume and objective means of the Pareto front reached so far over the last
+    # ngen_no_change generations, so that a front recovering a previous level does not count as an
+    # improvement. The means are signed so that higher is better, and the reference point of the
+    # hypervolume is fixed on the initial population
+    if ngen_no_change is not None:
+        ref = _referencePoint(population, max_features)
+        signs = np.sign(creator.Fitness_new.weights)
+        hv, front_mean = _frontStatistics(population, ref)
+        front_history = deque([(hv, signs * front_mean)], maxlen=ngen_no_change + 1)
+
     # Begin the generational process
-    wait = 0
     for gen in range(1, ngen + 1):
+        # If neither the hypervolume nor any objective mean of the Pareto front improved
+        # within the window, stop the optimization
+        if ngen_no_change is not None and len(front_history) > ngen_no_change:
+            (hv_old, front_best_old), (hv, front_best) = front_history[0], front_history[-1]
+            hv_gain = (hv - hv_old) / max(abs(hv_old), np.finfo(np.float64).tiny) / ngen_no_change
+            front_gain = (front_best - front_best_old) / ngen_no_change
+            if hv_gain < _HV_TOL and np.all(front_gain < _OBJ_TOL):
+                break
+
         # Select the next generation individuals
         offspring = toolbox.select(population, len(population) - hof_size)
 
-        # Vary the pool of individuals
-        if hparams:  # split the gene of each ind in offspring into [param 1's gene] + [param 2's gene] + ... + [gene for features] and variate each separately
-            n_pbits = hparams['bitwidth']
-            genes = []
-            i = 0
-            for _ in range(len(hparams['names'])):
-                offspring_h = [creator.Individual_new(ind[i:i+n_pbits]) for ind in offspring]
-                genes.append(algorithms.varAnd(offspring_h, toolbox, cxpb, mutpb))
-                i += n_pbits
-            offspring_f = [creator.Individual_new(ind[i:]) for ind in offspring]
-            genes.append(algorithms.varAnd(offspring_f, toolbox, cxpb, mutpb))
-            offspring = [creator.Individual_new(itertools.chain.from_iterable(ind)) for ind in zip(*genes)]
-        else:
-            offspring = algorithms.varAnd(offspring, toolbox, cxpb, mutpb)
+        # Vary the pool of individuals. The genes for the hparams and for the features are variated together,
+        # since crossover and mutation already exchange and flip each bit independently
+        offspring = algorithms.varAnd(offspring, toolbox, cxpb, mutpb)
 
         # Evaluate the individuals with an invalid fitness (i.e., the modified individuals)
-        invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
-        fitnesses = toolbox.map(toolbox.evaluate, invalid_ind)
-        for ind, fit in zip(invalid_ind, fitnesses):
-            ind.fitness.values = fit
+        invalid_ind = _evalInvalid(offspring, toolbox, max_features, hparam_bits)
 
         # Add the best back to population
         offspring.extend(halloffame.items)
 
-        # Get the previous best individual before updating the hall of fame
-        prev_best = halloffame[0]
-
         # Update the hall of fame with the generated individuals
         halloffame.update(offspring)
 
@@ -110,66 +237,133 @@ def _eaFunction(population, toolbox, cxpb, mutpb, ngen, ngen_no_change=None, sta
         if verbose:
             print(logbook.stream)
 
-        # If the new best individual is the same as the previous best individual,
-        # increment a counter, otherwise reset the counter
-        if halloffame[0] == prev_best:
-            wait += 1
-        else:
-            wait = 0
-
-        # If the counter reached the termination criteria, stop the optimization
-        if ngen_no_change is not None and wait >= ngen_no_change:
-            break
+        if ngen_no_change is not None:
+            hv, front_mean = _frontStatistics(population, ref)
+            hv_best, front_best = front_history[-1]
+            front_history.append((max(hv, hv_best), np.maximum(signs * front_mean, front_best)))
 
     return population, logbook
 
 
-def _createIndividual(icls, n, max_features, hparams, hparam_bits):  #@ icls: class for individual (here is a list)
+def _parallelMap(func, iterable, parallel):
+    # Dispatch the whole generation in a single call to the persistent pool of workers
+    return parallel(delayed(func)(item) for item in iterable)
+
+
+def _memmap(array, folder, name):
+    # Dump the array to a file and reopen it read-only, so that it is shared by the workers
+    # instead of being pickled with every dispatched batch
+    filename = os.path.join(folder, name + ".mmap")
+    dump(array, filename)
+    return load(filename, mmap_mode="r")
+
+
+def _cxUniform(ind1, ind2, indpb):
+    # Swap each gene between the two individuals with probability indpb. Only the genes that
+    # differ need to be swapped, which is done by XOR-ing both arrays in place with their difference
+    diff = np.bitwise_xor(ind1, ind2) & (np.random.random(len(ind1)) < indpb)
+    ind1 ^= diff
+    ind2 ^= diff
+    return ind1, ind2
+
+
+def _mutFlipBit(individual, indpb):
+    # Flip each gene of the individual with probability indpb, at once on the whole array
+    individual ^= np.random.random(len(individual)) < indpb
+    return individual,
+
+
+def _selTournament(individuals, k, tournsize):
+    # Select k individuals with tournaments of tournsize aspirants each, all drawn at once. The fitnesses
+    # are compared through their lexicographic rank, as the comparison of Fitness objects does
+    wvalues = np.array([ind.fitness.wvalues for ind in individuals])
+    ranks = np.empty(len(individuals), dtype=np.int64)
+    ranks[np.lexsort(wvalues.T[::-1])] = np.arange(len(individuals))
+    aspirants = np.random.randint(0, len(individuals), size=(k, tournsize))
+    winners = aspirants[np.arange(k), np.argmax(ranks[aspirants], axis=1)]
+    return [individuals[i] for i in winners]
+
+
+def _createIndividual(icls, n, max_features, hparams, hparam_bits):  #@ icls: class for individual (here is an int8 array)
     n_features = np.random.randint(1, max_features + 1)
-    f_genome = ([1] * n_features) + ([0] * (n - n_features))
+    f_genome = np.zeros(n, dtype=np.int8)
+    f_genome[:n_features] = 1
     np.random.shuffle(f_genome)
     if hparams:
         n_1 = np.random.randint(0, hparam_bits + 1)
-        h_genome = ([1] * n_1) + ([0] * (hparam_bits - n_1))
-        # h_genome = [0] * hparam_bits
+        h_genome = np.zeros(hparam_bits, dtype=np.int8)
+        h_genome[:n_1] = 1
         np.random.shuffle(h_genome)
-        return icls(h_genome + f_genome)
+        return icls(np.concatenate((h_genome, f_genome)))
     else:   return icls(f_genome)
 
 
-#@ Fitness function. Mod this to also include selecting hyperparams in GA
+def _bitsToInt(bits):
+    # Decimal value of a bit string, accumulated with shifts
+    value = 0
+    for bit in bits:
+        value = (value << 1) | bit
+    return value
+
+
+@njit(cache=True, fastmath=True)
+def _decodeIndividual(genes, n_hparams, hparam_pow2, hparam_min, hparam_scale):
+    # Split the genes of an individual into the decoded hyperparameter values, the mask of
+    # the selected features and the number of selected features
+    hparam_bits = n_hparams * hparam_pow2.shape[0]
+    mask = genes[hparam_bits:].view(np.bool_)
+    bits = genes[:hparam_bits].reshape((n_hparams, hparam_pow2.shape[0])).astype(np.int64)
+    hparam_vals = hparam_min + (bits * hparam_pow2).sum(axis=1) * hparam_scale
+    return mask, hparam_vals, mask.sum()
+
+
+def _crossValScore(estimator, X, y, groups, cv, scorer, fit_params, n_jobs, pre_dispatch, data_hash,
+                   individual_key):
+    # Cross-validation scores of an individual. When cached with a joblib.Memory, X, y and groups
+    # are ignored and identified by data_hash instead, so that they are not hashed at each call
+    return cross_val_score(estimator=estimator, X=X, y=y, groups=groups, scoring=scorer,
+                           cv=cv, fit_params=fit_params, n_jobs=n_jobs, pre_dispatch=pre_dispatch)
+
+
+#@ Fitness function, specialized at fit time: this one is used as is when no hyperparameter is tuned
 @ignore_warnings(category=ConvergenceWarning)
-def _evalFunction(individual, estimator, X, y, groups, cv, scorer, fit_params, max_features, hparams,
-                  caching, scores_cache={}):
-    if hparams:  #@ WHY this block causes a decrease in performance, even when hparams is None???
-        #@ extract info of hparams from individual's bit string
-        n_pbits = hparams['bitwidth']
-        i = 0
-        for j, hparam in enumerate(hparams['names']):
-            bin_str = individual[i:i+n_pbits]  # genotype
-            dec_val = int(''.join(str(b) for b in bin_str), 2)  # decimal value of bin string
-            p_min, p_max = hparams['range'][j][0], hparams['range'][j][1]
-            p = p_min + dec_val*((p_max-p_min)/(2**n_pbits-1))  # actual value of param (phenotype)
-            if hparam in ['max_depth']:      p = int(round(p, 0))
-            setattr(estimator, hparam, p)
-            i += n_pbits
-        individual = individual[i:]
-    individual_sum = np.sum(individual, axis=0)
-    if individual_sum == 0 or individual_sum > max_features:
-        return -10000, individual_sum, 10000
-    individual_tuple = tuple(individual)
-    if caching and individual_tuple in scores_cache:
-        return scores_cache[individual_tuple][0], individual_sum, scores_cache[individual_tuple][1]
-    X_selected = X[:, np.array(individual, dtype=np.bool)]
-    scores = cross_val_score(estimator=estimator, X=X_selected, y=y, groups=groups, scoring=scorer,
-                             cv=cv, fit_params=fit_params)
+def _evalFunction(individual, estimator, X, y, groups, cv, scorer, fit_params, cv_n_jobs, pre_dispatch,
+                  score_func, data_hash, scores_cache=None, cache_size=None, mask=None, individual_sum=None):
+    # Only feasible individuals are evaluated, see _evalInvalid
+    if mask is None:
+        mask = individual.mask
+        individual_sum = mask.sum()
+    # The key also covers the hyperparameter bits, so that the same features with
+    # different hyperparameters are scored separately
+    individual_key = np.packbits(individual.mask).tobytes()
+    if scores_cache is not None and individual_key in scores_cache:
+        scores_cache.move_to_end(individual_key)
+        return scores_cache[individual_key][0], individual_sum, scores_cache[individual_key][1]
+    X_selected = X[:, mask]
+    scores = score_func(estimator=estimator, X=X_selected, y=y, groups=groups, cv=cv, scorer=scorer,
+                        fit_params=fit_params, n_jobs=cv_n_jobs, pre_dispatch=pre_dispatch, data_hash=data_hash,
+                        individual_key=individual_key)
     scores_mean = np.mean(scores)
     scores_std = np.std(scores)
-    if caching:
-        scores_cache[individual_tuple] = [scores_mean, scores_std]
+    if scores_cache is not None:
+        scores_cache[individual_key] = [scores_mean, scores_std]
+        if cache_size is not None and len(scores_cache) > cache_size:
+            scores_cache.popitem(last=False)  # evict the least recently used scores
     return scores_mean, individual_sum, scores_std  #@ multi-objective fitness function
 
 
+#@ Fitness function when hyperparams are also selected by the GA
+def _evalFunctionHparams(individual, estimator, hparams, n_hparams, hparam_pow2, hparam_min, hparam_scale,
+                         **kwargs):
+    mask, hparam_vals, individual_sum = _decodeIndividual(individual.view(np.ndarray), n_hparams,
+                                                          hparam_pow2, hparam_min, hparam_scale)
+    #@ set the hparams decoded from individual's bit string (genotype -> phenotype)
+    for hparam, p in zip(hparams['names'], hparam_vals.tolist()):
+        if hparam in ['max_depth']:      p = int(round(p, 0))
+        setattr(estimator, hparam, p)
+    return _evalFunction(individual, estimator, mask=mask, individual_sum=individual_sum, **kwargs)
+
+
 class GeneticSelectionCV_mod(BaseEstimator, MetaEstimatorMixin, SelectorMixin):
     """Feature selection with genetic algorithm.
 
@@ -232,12 +426,36 @@ class GeneticSelectionCV_mod(BaseEstimator, MetaEstimatorMixin, SelectorMixin):
         Tournament size for the genetic algorithm.
 
     n_gen_no_change : int, default None
-        If set to a number, it will terminate optimization when best individual is not
-        changing in all of the previous ``n_gen_no_change`` number of generations.
+        If set to a number, it will terminate optimization when the Pareto front has
+        stagnated over the previous ``n_gen_no_change`` number of generations, i.e. when
+        neither its hypervolume nor the mean of any of its objectives improved by more
+        than a small tolerance per generation. Must be at least 1.
 
     caching : boolean, default=False
         If True, scores of the genetic algorithm are cached.
 
+    cache_size : int or None, default=None
+        Maximum number of scores kept when ``caching`` is True, the least recently
+        used ones being evicted first. If None, the cache is unbounded. The cache is
+        emptied at each call to ``fit``.
+
+    memory : None, str or object with the joblib.Memory interface, default=None
+        Used to cache the cross-validation scores of the individuals on disk, so that
+        they are reused across calls to ``fit`` on the same data. By default, no
+        caching is performed. If a string is given, it is the path to the caching
+        directory.
+
+    cv_n_jobs : int, default=1
+        Number of jobs to run in parallel for the cross-validation of each individual.
+        Keep it to 1 when ``n_jobs`` is not 1: the individuals are then already
+        evaluated in parallel, with the BLAS/OpenMP threads of each worker limited to one.
+
+    pre_dispatch : int or str, default='2*n_jobs'
+        Controls the number of jobs that get dispatched during parallel execution, both
+        of the individuals when ``n_jobs`` is not 1 and of the cross-validation folds
+        when ``cv_n_jobs`` is not 1. Reducing this number limits the copies of the
+        data and the memory held by pending jobs. See ``joblib.Parallel``.
+
     Attributes
     ----------
     n_features_ : int
@@ -249,6 +467,11 @@ class GeneticSelectionCV_mod(BaseEstimator, MetaEstimatorMixin, SelectorMixin):
     generation_scores_ : array of shape [n_generations]
         The maximum cross-validation score for each generation.
 
+    scores_cache_ : OrderedDict
+        The mean and standard deviation of the cross-validation scores cached during
+        the fit when ``caching`` is True, keyed on the genes of the individuals. Only
+        filled when ``n_jobs`` is 1, as the workers hold their own copy of the cache.
+
     estimator_ : object
         The external estimator fit on the reduced dataset.
 
@@ -274,7 +497,7 @@ class GeneticSelectionCV_mod(BaseEstimator, MetaEstimatorMixin, SelectorMixin):
                  verbose=0, n_jobs=1, n_population=300, crossover_proba=0.5, mutation_proba=0.2,
                  n_generations=40, crossover_independent_proba=0.1,
                  mutation_independent_proba=0.05, tournament_size=3, n_gen_no_change=None, hparams=None,
-                 caching=False):
+                 caching=False, cache_size=None, memory=None, cv_n_jobs=1, pre_dispatch='2*n_jobs'):
         self.estimator = estimator
         self.cv = cv
         self.scoring = scoring
@@ -293,7 +516,10 @@ class GeneticSelectionCV_mod(BaseEstimator, MetaEstimatorMixin, SelectorMixin):
         self.hparams = hparams
         self.hparam_bits = len(self.hparams['names'])*self.hparams['bitwidth'] if self.hparams else 0  #@ number of bits for all hyperparameters to be tuned
         self.caching = caching
-        self.scores_cache = {}
+        self.cache_size = cache_size
+        self.memory = memory
+        self.cv_n_jobs = cv_n_jobs
+        self.pre_dispatch = pre_dispatch
 
     @property
     def _estimator_type(self):
@@ -341,6 +567,42 @@ class GeneticSelectionCV_mod(BaseEstimator, MetaEstimatorMixin, SelectorMixin):
             raise ValueError("'n_gen_no_change' should either be None or an integer."
                              " {} was passed."
                              .format(self.n_gen_no_change))
+        elif self.n_gen_no_change is not None and self.n_gen_no_change < 1:
+            raise ValueError("'n_gen_no_change' should be a positive integer."
+                             " Got {} instead."
+                             .format(self.n_gen_no_change))
+
+        if self.cache_size is not None:
+            if not isinstance(self.cache_size, numbers.Integral):
+                raise TypeError("'cache_size' should either be None or a positive integer."
+                                " Got {!r} instead."
+                                .format(self.cache_size))
+            elif self.cache_size < 1:
+                raise ValueError("'cache_size' should either be None or a positive integer."
+                                 " Got {} instead."
+                                 .format(self.cache_size))
+
+        # The bits of each hyperparameter are decoded with int64 arithmetic
+        if self.hparams:
+            n_pbits = self.hparams['bitwidth']
+            if not isinstance(n_pbits, numbers.Integral) or not 1 <= n_pbits <= 62:
+                raise ValueError("The 'bitwidth' of 'hparams' should be an integer between 1 and 62."
+                                 " Got {!r} instead."
+                                 .format(n_pbits))
+
+        if self.n_jobs == 0:
+            raise ValueError("n_jobs == 0 has no meaning.")
+        elif self.n_jobs < 0:
+            n_jobs = max(cpu_count() + 1 + self.n_jobs, 1)
+        else:
+            n_jobs = self.n_jobs
+
+        # Cache the scores of the individuals in memory for this fit only, and optionally across
+        # fits with the joblib.Memory, keyed on the data and the genes of the individuals
+        self.scores_cache_ = OrderedDict()
+        memory = check_memory(self.memory)
+        score_func = memory.cache(_crossValScore, ignore=['X', 'y', 'groups', 'n_jobs', 'pre_dispatch'])
+        data_hash = hash_data((X, y, groups)) if getattr(memory, 'location', None) is not None else None
 
         estimator = clone(self.estimator)
 
@@ -350,60 +612,82 @@ class GeneticSelectionCV_mod(BaseEstimator, MetaEstimatorMixin, SelectorMixin):
         toolbox.register("individual", _createIndividual, creator.Individual_new, n=n_features,
                          max_features=max_features, hparams=self.hparams, hparam_bits=self.hparam_bits)
         toolbox.register("population", tools.initRepeat, list, toolbox.individual)
-        toolbox.register("evaluate", _evalFunction, estimator=estimator, X=X, y=y,
-                         groups=groups, cv=cv, scorer=scorer, fit_params=self.fit_params,
-                         max_features=max_features, hparams=self.hparams, caching=self.caching,
-                         scores_cache=self.scores_cache)
-        toolbox.register("mate", tools.cxUniform, indpb=self.crossover_independent_proba)
-        toolbox.register("mutate", tools.mutFlipBit, indpb=self.mutation_independent_proba)
-        toolbox.register("select", tools.selTournament, tournsize=self.tournament_size)
-
-        if self.n_jobs == 0:
-            raise ValueError("n_jobs == 0 has no meaning.")
-        elif self.n_jobs > 1:
-            pool = multiprocess.Pool(processes=self.n_jobs)
-            toolbox.register("map", pool.map)
-        elif self.n_jobs < 0:
-            pool = multiprocess.Pool(processes=max(cpu_count() + 1 + self.n_jobs, 1))
-            toolbox.register("map", pool.map)
+        if self.hparams:
+            # Precompute the constants to decode the bit string of each hyperparameter
+            n_pbits = self.hparams['bitwidth']
+            hparam_range = np.asarray(self.hparams['range'], dtype=np.float64)
+            evaluate = partial(_evalFunctionHparams, hparams=self.hparams,
+                               n_hparams=len(self.hparams['names']),
+                               hparam_pow2=1 << np.arange(n_pbits - 1, -1, -1, dtype=np.int64),
+                               hparam_min=np.ascontiguousarray(hparam_range[:, 0]),
+                               hparam_scale=(hparam_range[:, 1] - hparam_range[:, 0]) / (2**n_pbits - 1))
+        else:
+            evaluate = _evalFunction
+        toolbox.register("mate", _cxUniform, indpb=self.crossover_independent_proba)
+        toolbox.register("mutate", _mutFlipBit, indpb=self.mutation_independent_proba)
+        toolbox.register("select", _selTournament, tournsize=self.tournament_size)
 
         pop = toolbox.population(n=self.n_population)
-        hof = tools.HallOfFame(1, similar=np.array_equal)
-        stats = tools.Statistics(lambda ind: ind.fitness.values)
-        stats.register("avg", np.mean, axis=0)
-        stats.register("std", np.std, axis=0)
-        stats.register("min", np.min, axis=0)
-        stats.register("max", np.max, axis=0)
+        hof = _HallOfFame()
+        stats = _FitnessStatistics()
 
         if self.verbose > 0:
             print("Selecting features with genetic algorithm.")
 
-        with np.printoptions(precision=6, suppress=True, sign=" "):
-            _, log = _eaFunction(pop, toolbox, cxpb=self.crossover_proba,
-                                 mutpb=self.mutation_proba, ngen=self.n_generations,
-                                 ngen_no_change=self.n_gen_no_change,
-                                 stats=stats, halloffame=hof, verbose=self.verbose, hparams=self.hparams, hparam_bits=self.hparam_bits)
-        if self.n_jobs != 1:
-            pool.close()
-            pool.join()
+        with ExitStack() as stack:
+            # Selecting the features of an individual from a Fortran-ordered X copies whole
+            # contiguous columns instead of gathering strided values from each row
+            X_shared = X if sparse.issparse(X) else np.asfortranarray(X)
+            y_shared = y
+
+            # Share X and y with the workers through memory-mapped files, removed on exit even if
+            # the fit fails; the workers are shut down before the files are removed
+            if n_jobs > 1:
+                temp_folder = tempfile.mkdtemp(prefix="genetic_selection_")
+                stack.callback(shutil.rmtree, temp_folder, ignore_errors=True)
+                if not sparse.issparse(X):
+                    X_shared = _memmap(X_shared, temp_folder, "X")
+                if not y.dtype.hasobject:
+                    y_shared = _memmap(y, temp_folder, "y")
+
+            toolbox.register("evaluate", evaluate, estimator=estimator, X=X_shared, y=y_shared,
+                             groups=groups, cv=cv, scorer=scorer, fit_params=self.fit_params,
+                             cv_n_jobs=self.cv_n_jobs, pre_dispatch=self.pre_dispatch,
+                             scores_cache=self.scores_cache_ if self.caching else None,
+                             cache_size=self.cache_size, score_func=score_func, data_hash=data_hash)
+
+            # The pool of workers is started once and reused by every generation; the batch size is
+            # adapted on each call, as only the few changed individuals are dispatched after generation 0
+            if n_jobs > 1:
+                # Nested BLAS/OpenMP threads of the workers are capped to avoid oversubscribing the cores
+                with parallel_backend("loky", inner_max_num_threads=1):
+                    parallel = Parallel(n_jobs=n_jobs, pre_dispatch=self.pre_dispatch, batch_size="auto")
+                stack.enter_context(parallel)
+                toolbox.register("map", _parallelMap, parallel=parallel)
+
+            with np.printoptions(precision=6, suppress=True, sign=" "):
+                _, log = _eaFunction(pop, toolbox, cxpb=self.crossover_proba,
+                                     mutpb=self.mutation_proba, ngen=self.n_generations,
+                                     max_features=max_features,
+                                     ngen_no_change=self.n_gen_no_change,
+                                     stats=stats, halloffame=hof, verbose=self.verbose, hparam_bits=self.hparam_bits)
 
         # Set final attributes
+        support_ = hof[0].mask[self.hparam_bits:].copy()
         if self.hparams:
-            support_ = np.array(hof, dtype=np.bool)[0][self.hparam_bits:]
             n_pbits = self.hparams['bitwidth']
             i = 0
             best_params_binstr = hof[0][:self.hparam_bits]
             best_params_ = {}
             for j, hparam in enumerate(self.hparams['names']):
                 bin_str = best_params_binstr[i:i+n_pbits]  # genotype
-                dec_val = int(''.join(str(b) for b in bin_str), 2)  # decimal value of bin string
+                dec_val = _bitsToInt(bin_str.tolist())  # decimal value of bin string
                 p_min, p_max = self.hparams['range'][j][0], self.hparams['range'][j][1]
                 p = p_min + dec_val*((p_max-p_min)/(2**n_pbits-1))  # actual value of param (phenotype)
                 best_params_[hparam] = p
                 i += n_pbits
             self.best_params_ = best_params_
         else:
-            support_ = np.array(hof, dtype=np.bool)[0]
             self.best_params_ = self.estimator.get_params()
         self.estimator_ = clone(self.estimator)
         self.estimator_.fit(X[:, support_], y)
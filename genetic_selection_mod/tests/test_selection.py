@@ -2,8 +2,11 @@ import random
 
 import numpy as np
 import pytest
+from deap import creator
 from sklearn import datasets, linear_model
-from genetic_selection import GeneticSelectionCV
+from genetic_selection_mod import GeneticSelectionCV_mod
+from genetic_selection_mod import gscv
+from genetic_selection_mod.gscv import _frontStatistics, _referencePoint
 
 
 @pytest.fixture
@@ -21,7 +24,7 @@ def test_genetic_selection(data):
     X = data[0]
     y = data[1]
     estimator = linear_model.LogisticRegression(solver="liblinear", multi_class="ovr")
-    selector = GeneticSelectionCV(
+    selector = GeneticSelectionCV_mod(
         estimator,
         cv=5,
         verbose=1,
@@ -70,3 +73,198 @@ def test_genetic_selection(data):
             ]
         ),
     )
+
+
+def test_genetic_selection_hparams(data):
+    random.seed(42)
+    np.random.seed(42)
+    X = data[0]
+    y = data[1]
+    estimator = linear_model.LogisticRegression(solver="liblinear", multi_class="ovr")
+    hparams = {"names": ["C"], "bitwidth": 4, "range": [(0.1, 10.0)]}
+    selector = GeneticSelectionCV_mod(
+        estimator,
+        cv=5,
+        scoring="accuracy",
+        max_features=5,
+        n_population=50,
+        n_generations=40,
+        crossover_independent_proba=0.5,
+        n_gen_no_change=10,
+        hparams=hparams,
+    )
+    selector = selector.fit(X, y)
+    assert selector.support_.shape == (X.shape[1],)
+    assert 1 <= selector.n_features_ <= 5
+    assert set(selector.best_params_) == {"C"}
+    assert 0.1 <= selector.best_params_["C"] <= 10.0
+    assert selector.generation_scores_[-1] > 0.9
+
+
+@pytest.mark.parametrize("bitwidth", [0, 63, 64])
+def test_genetic_selection_hparams_bitwidth(data, bitwidth):
+    X, y = data
+    estimator = linear_model.LogisticRegression(solver="liblinear", multi_class="ovr")
+    hparams = {"names": ["C"], "bitwidth": bitwidth, "range": [(0.1, 10.0)]}
+    selector = GeneticSelectionCV_mod(estimator, hparams=hparams)
+    with pytest.raises(ValueError, match="bitwidth"):
+        selector.fit(X, y)
+
+
+def _population(fitnesses, genes=None):
+    if genes is None:
+        genes = [[1, 1, 1]] * len(fitnesses)
+    population = []
+    for values, ind_genes in zip(fitnesses, genes):
+        ind = creator.Individual_new(np.array(ind_genes, dtype=np.int8))
+        ind.fitness.values = values
+        population.append(ind)
+    return population
+
+
+def test_front_statistics():
+    front = [(0.8, 2, 0.05), (0.9, 3, 0.04), (0.85, 1, 0.1)]
+    ref = _referencePoint(_population(front + [(0.7, 2, 0.12)]), max_features=5)
+    hv, front_mean = _frontStatistics(_population(front), ref)
+    assert hv > 0
+    np.testing.assert_allclose(front_mean, np.mean(front, axis=0))
+
+    # Infeasible individuals are left out of the reference point and of the front
+    population = _population(front + [(0.7, 2, 0.12), (-10000, 0, 10000)])
+    np.testing.assert_allclose(_referencePoint(population, max_features=5), ref)
+    hv_infeasible, front_mean_infeasible = _frontStatistics(_population(front + [(-10000, 0, 10000)]), ref)
+    assert hv_infeasible == pytest.approx(hv)
+    np.testing.assert_allclose(front_mean_infeasible, front_mean)
+
+    # The hypervolume rises when the front improves
+    better_front = [(0.85, 2, 0.05), (0.95, 3, 0.03), (0.85, 1, 0.08)]
+    hv_better, _ = _frontStatistics(_population(better_front), ref)
+    assert hv_better > hv
+
+    # Up to max_features, a point with more features or a larger std than the initial population
+    # stays inside the reference box
+    assert _frontStatistics(_population([(0.97, 5, 0.15)]), ref)[0] > 0
+
+
+@pytest.mark.parametrize("n_gen_no_change", [0, -1])
+def test_genetic_selection_n_gen_no_change(data, n_gen_no_change):
+    X, y = data
+    estimator = linear_model.LogisticRegression(solver="liblinear", multi_class="ovr")
+    selector = GeneticSelectionCV_mod(estimator, n_gen_no_change=n_gen_no_change)
+    with pytest.raises(ValueError, match="n_gen_no_change"):
+        selector.fit(X, y)
+
+
+def test_genetic_selection_memory(data, tmp_path, monkeypatch):
+    X, y = data
+    n_scores = []
+    cross_val_score = gscv.cross_val_score
+
+    def counting_cross_val_score(*args, **kwargs):
+        n_scores[-1] += 1
+        return cross_val_score(*args, **kwargs)
+
+    monkeypatch.setattr(gscv, "cross_val_score", counting_cross_val_score)
+    # With a fixed random_state, the cache hits do not change the random stream of the genetic algorithm
+    estimator = linear_model.LogisticRegression(solver="liblinear", multi_class="ovr", random_state=0)
+    supports = []
+    for _ in range(2):
+        n_scores.append(0)
+        random.seed(0)
+        np.random.seed(0)
+        selector = GeneticSelectionCV_mod(estimator, n_population=20, n_generations=5, memory=str(tmp_path))
+        supports.append(selector.fit(X, y).support_)
+    assert n_scores[0] > 0
+    assert n_scores[1] == 0
+    np.testing.assert_array_equal(supports[0], supports[1])
+
+
+def test_genetic_selection_hparams_single_variation(data, monkeypatch):
+    # Variating the hparam and feature genes with a single varAnd reaches the same scores
+    # as splitting each individual into one segment per hparam plus the features
+    X, y = data
+    estimator = linear_model.LogisticRegression(solver="liblinear", multi_class="ovr")
+    hparams = {"names": ["C"], "bitwidth": 4, "range": [(0.1, 10.0)]}
+    var_and = gscv.algorithms.varAnd
+
+    def split_var_and(population, toolbox, cxpb, mutpb):
+        bounds = [0, 4, X.shape[1] + 4]
+        segments = [
+            var_and([creator.Individual_new(ind[start:stop]) for ind in population], toolbox, cxpb, mutpb)
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        ]
+        return [creator.Individual_new(np.concatenate(genes)) for genes in zip(*segments)]
+
+    scores = []
+    for variation in (var_and, split_var_and):
+        monkeypatch.setattr(gscv.algorithms, "varAnd", variation)
+        variation_scores = []
+        for seed in range(5):
+            random.seed(seed)
+            np.random.seed(seed)
+            selector = GeneticSelectionCV_mod(
+                estimator, max_features=5, n_population=30, n_generations=15, hparams=hparams
+            )
+            variation_scores.append(selector.fit(X, y).generation_scores_)
+        scores.append(np.mean(variation_scores, axis=0))
+    np.testing.assert_allclose(scores[0], scores[1], atol=0.02)
+
+
+def test_hall_of_fame_keeps_same_genes():
+    hof = gscv._HallOfFame()
+    hof.update(_population([(0.8, 2, 0.05)]))
+    # A copy of the held individual scoring higher (e.g. on a new CV split) does not replace it
+    hof.update(_population([(0.9, 2, 0.05)]))
+    assert hof[0].fitness.values == (0.8, 2, 0.05)
+
+
+def test_hall_of_fame_skips_same_genes():
+    hof = gscv._HallOfFame()
+    hof.update(_population([(0.8, 1, 0.05)], genes=[[1, 0, 0]]))
+    # The best individual is a copy of the held one, but another one also improves on it
+    hof.update(_population([(0.9, 1, 0.05), (0.85, 1, 0.05)], genes=[[1, 0, 0], [0, 1, 0]]))
+    np.testing.assert_array_equal(hof[0], [0, 1, 0])
+    assert hof[0].fitness.values == (0.85, 1, 0.05)
+
+
+@pytest.mark.parametrize("n_jobs, cv_n_jobs", [(2, 1), (1, 2)])
+def test_genetic_selection_n_jobs(data, n_jobs, cv_n_jobs):
+    random.seed(42)
+    np.random.seed(42)
+    X, y = data
+    estimator = linear_model.LogisticRegression(solver="liblinear", multi_class="ovr")
+    selector = GeneticSelectionCV_mod(
+        estimator,
+        max_features=5,
+        n_population=20,
+        n_generations=5,
+        n_jobs=n_jobs,
+        cv_n_jobs=cv_n_jobs,
+        pre_dispatch="n_jobs",
+    )
+    selector = selector.fit(X, y)
+    assert selector.support_.shape == (X.shape[1],)
+    assert 1 <= selector.n_features_ <= 5
+    assert selector.generation_scores_[-1] > 0.9
+
+
+def test_genetic_selection_cache_size(data):
+    X, y = data
+    estimator = linear_model.LogisticRegression(solver="liblinear", multi_class="ovr")
+    selector = GeneticSelectionCV_mod(estimator, n_population=20, n_generations=5, caching=True, cache_size=5)
+    selector.fit(X, y)
+    assert 0 < len(selector.scores_cache_) <= 5
+    scores_cache = selector.scores_cache_
+    # Each fit starts from an empty cache
+    selector.fit(X[:, :4], y)
+    assert selector.scores_cache_ is not scores_cache
+    assert all(len(key) == 1 for key in selector.scores_cache_)
+
+
+@pytest.mark.parametrize("cache_size, error", [(0, ValueError), (-1, ValueError), (2.5, TypeError)])
+def test_genetic_selection_cache_size_invalid(data, cache_size, error):
+    X, y = data
+    estimator = linear_model.LogisticRegression(solver="liblinear", multi_class="ovr")
+    selector = GeneticSelectionCV_mod(estimator, caching=True, cache_size=cache_size)
+    with pytest.raises(error, match="cache_size"):
+        selector.fit(X, y)